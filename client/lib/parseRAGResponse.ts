@@ -27,13 +27,17 @@ export function parseRAGResponse(rawResponse: string): ParsedResponse {
       );
 
       try {
-        const jsonStr = metadataContent
-          .replace(/'/g, '"')
-          .replace(/True/g, 'true')
-          .replace(/False/g, 'false')
-          .replace(/None/g, 'null');
+        try {
+          metadata = JSON.parse(metadataContent);
+        } catch {
+          const jsonStr = metadataContent
+            .replace(/'/g, '"')
+            .replace(/True/g, 'true')
+            .replace(/False/g, 'false')
+            .replace(/None/g, 'null');
 
-        metadata = JSON.parse(jsonStr);
+          metadata = JSON.parse(jsonStr);
+        }
         result.sources = metadata.sources || [];
         result.context = metadata.context || "";
 
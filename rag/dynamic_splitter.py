@@ -15,23 +15,47 @@ class ChemicalNormalizer:
         "DAP": ["diammonium phosphate", "(NH4)2HPO4"],
     }
     
+    # Translation tables and regexes are built once at import instead of on every call
+    SUBSCRIPT_MAP = str.maketrans('₀₁₂₃₄₅₆₇₈₉', '0123456789')
+    SUPERSCRIPT_MAP = str.maketrans('⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻', '0123456789+-')
+    WHITESPACE_RE = re.compile(r'\s+')
+    PERCENT_RE = re.compile(r'(\d+)\s*%')
+    DEGREE_RE = re.compile(r'(\d+)\s*°C')
+    RANGE_RE = re.compile(r'(\d+)\s*-\s*(\d+)')
+
+    FORMULA_RE = re.compile(r'\b[A-Z][a-z]?\d*(?:[A-Z][a-z]?\d*)*\b')
+    CONCENTRATION_RE = re.compile(r'\d+(?:\.\d+)?(?:-\d+(?:\.\d+)?)?%?\s*(?:P2O5|H2SO4|H3PO4)?')
+    TEMPERATURE_RE = re.compile(r'\d+(?:\.\d+)?°C')
+    EQUIPMENT_RES = [
+        re.compile(pattern, re.IGNORECASE) for pattern in (
+            r'filtre\w*', r'réacteur\w*', r'cristalliseur\w*',
+            r'évaporateur\w*', r'broyeur\w*', r'sécheur\w*'
+        )
+    ]
+
+    SECTION_HEADER_RE = re.compile('|'.join(f'(?:{pattern})' for pattern in (
+        r'^\d+\.\s+[A-Z]',
+        r'^[A-Z\s]{5,}$',
+        r'^Section\s+\d+',
+        r'^CHAPITRE\s+\d+',
+        r'^Annexe\s+[A-Z\d]',
+    )))
+    
     @staticmethod
     def normalize_text(text: str) -> str:
-        subscript_map = str.maketrans('₀₁₂₃₄₅₆₇₈₉', '0123456789')
-        text = text.translate(subscript_map)
+        text = text.translate(ChemicalNormalizer.SUBSCRIPT_MAP)
         
         # Convertir superscripts
-        superscript_map = str.maketrans('⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻', '0123456789+-')
-        text = text.translate(superscript_map)
+        text = text.translate(ChemicalNormalizer.SUPERSCRIPT_MAP)
         
         # Normaliser les espaces multiples
-        text = re.sub(r'\s+', ' ', text)
+        text = ChemicalNormalizer.WHITESPACE_RE.sub(' ', text)
         
-        text = re.sub(r'(\d+)\s*%', r'\1%', text)
+        text = ChemicalNormalizer.PERCENT_RE.sub(r'\1%', text)
         
-        text = re.sub(r'(\d+)\s*°C', r'\1°C', text)
+        text = ChemicalNormalizer.DEGREE_RE.sub(r'\1°C', text)
         
-        text = re.sub(r'(\d+)\s*-\s*(\d+)', r'\1-\2', text)
+        text = ChemicalNormalizer.RANGE_RE.sub(r'\1-\2', text)
         
         return text.strip()
     
@@ -44,22 +68,17 @@ class ChemicalNormalizer:
             "equipment": []
         }
         
-        formulas = re.findall(r'\b[A-Z][a-z]?\d*(?:[A-Z][a-z]?\d*)*\b', text)
+        formulas = ChemicalNormalizer.FORMULA_RE.findall(text)
         entities["formulas"] = list(set(f for f in formulas if len(f) > 1))
         
-        concentrations = re.findall(r'\d+(?:\.\d+)?(?:-\d+(?:\.\d+)?)?%?\s*(?:P2O5|H2SO4|H3PO4)?', text)
+        concentrations = ChemicalNormalizer.CONCENTRATION_RE.findall(text)
         entities["concentrations"] = list(set(concentrations))
         
-        temperatures = re.findall(r'\d+(?:\.\d+)?°C', text)
+        temperatures = ChemicalNormalizer.TEMPERATURE_RE.findall(text)
         entities["temperatures"] = list(set(temperatures))
         
-        equipment_patterns = [
-            r'filtre\w*', r'réacteur\w*', r'cristalliseur\w*',
-            r'évaporateur\w*', r'broyeur\w*', r'sécheur\w*'
-        ]
-        for pattern in equipment_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            entities["equipment"].extend(matches)
+        for pattern in ChemicalNormalizer.EQUIPMENT_RES:
+            entities["equipment"].extend(pattern.findall(text))
         
         entities["equipment"] = list(set(entities["equipment"]))
         
@@ -67,14 +86,7 @@ class ChemicalNormalizer:
     
     @staticmethod
     def is_section_header(text: str) -> bool:
-        patterns = [
-            r'^\d+\.\s+[A-Z]',
-            r'^[A-Z\s]{5,}$',
-            r'^Section\s+\d+',
-            r'^CHAPITRE\s+\d+',
-            r'^Annexe\s+[A-Z\d]',
-        ]
-        return any(re.match(pattern, text.strip()) for pattern in patterns)
+        return ChemicalNormalizer.SECTION_HEADER_RE.match(text.strip()) is not None
 
 
 class DynamicTechnicalTextSplitter:
@@ -87,6 +99,7 @@ class DynamicTechnicalTextSplitter:
     TABLE_PATTERNS = [
         r'\|', r'\t', r'\s{4,}', r'(?:(?:\d+[,\.]?\d*)\s+){3,}'
     ]
+    TABLE_RE = re.compile('|'.join(TABLE_PATTERNS))
 
     def __init__(self):
         self.normalizer = ChemicalNormalizer()
@@ -101,10 +114,7 @@ class DynamicTechnicalTextSplitter:
         lines = text.splitlines(keepends=True)
         matches = []
         for ln in lines:
-            if any(re.search(p, ln) for p in self.TABLE_PATTERNS):
-                matches.append(True)
-            else:
-                matches.append(False)
+            matches.append(self.TABLE_RE.search(ln) is not None)
 
         blocks = []
         start = None
@@ -172,23 +182,20 @@ class DynamicTechnicalTextSplitter:
                 if cursor < len(text):
                     segments.append((cursor, len(text)))
 
+            # One splitter per document: every segment shares the same size/overlap
+            splitter = RecursiveCharacterTextSplitter(
+                chunk_size=size,
+                chunk_overlap=overlap,
+                separators=["\n\n", "\n", ". ", ";", ","],
+            )
+            metadata = {**doc.metadata, "dynamic_size": size, "dynamic_overlap": overlap}
+
             for seg_start, seg_end in segments:
                 seg_text = text[seg_start:seg_end].strip()
                 if not seg_text:
                     continue
 
-                splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=size,
-                    chunk_overlap=overlap,
-                    separators=["\n\n", "\n", ". ", ";", ","],
-                )
-
-                seg_doc = Document(page_content=seg_text, metadata=doc.metadata.copy())
-                seg_chunks = splitter.split_documents([seg_doc])
-
-                for ch in seg_chunks:
-                    ch.metadata["dynamic_size"] = size
-                    ch.metadata["dynamic_overlap"] = overlap
-                    chunks.append(ch)
+                for chunk_text in splitter.split_text(seg_text):
+                    chunks.append(Document(page_content=chunk_text, metadata=metadata.copy()))
 
         return chunks
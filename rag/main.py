@@ -1,5 +1,8 @@
+import asyncio
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException, status
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
@@ -12,6 +15,11 @@ logger = logging.getLogger(__name__)
 
 INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
 OLLAMA_HOST = os.getenv("OLLAMA_HOST_URL", "http://localhost:11434")
+# A single process serves concurrent requests through the loop's default thread pool (retrieval and reranking
+# run in asyncio.to_thread), so the models are loaded once instead of once per uvicorn worker.
+# Unset keeps Python's default of min(32, cpu_count + 4) threads.
+RAG_THREADS = os.getenv("RAG_THREADS")
+RAG_THREADS = int(RAG_THREADS) if RAG_THREADS else None
 
 logger.info(f"INTERNAL_API_KEY loaded: {INTERNAL_API_KEY[:10] + '...' if INTERNAL_API_KEY else 'NOT SET'}")
 logger.info(f"OLLAMA_HOST: {OLLAMA_HOST}")
@@ -19,10 +27,18 @@ logger.info(f"OLLAMA_HOST: {OLLAMA_HOST}")
 os.environ["OLLAMA_HOST_URL"] = OLLAMA_HOST
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if RAG_THREADS is not None:
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=RAG_THREADS))
+    yield
+
+
 app = FastAPI(
     title="AI Service (FastAPI RAG)",
     description="Orchestrates RAG logic and streams LLM responses.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 
@@ -82,4 +98,11 @@ async def stream_response_endpoint(request: Request):
             error_stream(),
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             media_type="text/plain"
-        )
\ No newline at end of file
+        )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Passing the app object keeps a single worker process holding one copy of the models
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")))
@@ -1,20 +1,28 @@
 
 # rag_api.py
+import asyncio
+import functools
+import hashlib
+import json
 import logging
+import re
+import threading
 import time
-from typing import Generator, Dict, Any, List, Tuple
+from typing import AsyncGenerator, Callable, Dict, Any, List, Optional, Tuple
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
+import bm25s
+import numpy as np
 import torch
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse, JSONResponse
-from pydantic import BaseModel
+import cachetools
 
 from langchain_chroma import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_ollama import ChatOllama
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_community.retrievers import BM25Retriever
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
 from langchain_core.documents import Document
 from sentence_transformers import CrossEncoder
 from dataclasses import dataclass
@@ -23,10 +31,22 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DB_DIR = os.getenv("VECTORSTORE_DIR", "vectorstore")
+# Bump whenever _preprocess changes: a saved index is only valid for the tokenizer that built it
+BM25_TOKENIZER_VERSION = 2
+BM25_INDEX_DIR = os.path.join(DB_DIR, f"bm25s-v{BM25_TOKENIZER_VERSION}")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "intfloat/multilingual-e5-large")
 RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "auto")  # auto (ONNX on CPU, PyTorch on GPU), onnx or torch
+RERANKER_ONNX_DIR = os.getenv("RERANKER_ONNX_DIR", "models")
+RERANKER_MAX_LENGTH = int(os.getenv("RERANKER_MAX_LENGTH", "256"))
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "64"))
+RERANKER_COMPILE = os.getenv("RERANKER_COMPILE", "1") == "1"
 LLM_MODEL = os.getenv("LLM_MODEL", "qwen2.5:14b-instruct-q4_K_M")
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "512"))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
 SYSTEM_PROMPT = """Tu es un assistant technique expert des procédés Prayon.
 
 RÈGLES IMPORTANTES:
@@ -39,12 +59,23 @@ RÈGLES IMPORTANTES:
 CONTEXTE DOCUMENTAIRE:
 {context}
 """
+# Split once at import so each request only joins strings instead of running str.format
+SYSTEM_PROMPT_PREFIX, SYSTEM_PROMPT_SUFFIX = SYSTEM_PROMPT.split("{context}")
+CONTEXT_SEPARATOR = "\n\n---\n\n"
 
 DEFAULT_RRF_K = 60
 
-class ChatRequest(BaseModel):
-    question: str
-    conversationId: int = None
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+def _preprocess(text: str) -> List[str]:
+    """BM25 tokenizer shared by indexing and querying: lowercase once, then one precompiled regex pass.
+
+    Changing it invalidates saved indexes; bump BM25_TOKENIZER_VERSION with it.
+    """
+    return _WORD.findall(text.lower())
+
+def normalize_question(text: str) -> str:
+    return text.strip().lower()
 
 @dataclass
 class RRFResult:
@@ -54,7 +85,8 @@ class RRFResult:
 
 def reciprocal_rank_fusion(
     search_results_list: List[List[Document]],
-    k: int = DEFAULT_RRF_K
+    k: int = DEFAULT_RRF_K,
+    top_n: Optional[int] = None
 ) -> List[RRFResult]:
     doc_scores = {}
     for method_idx, results in enumerate(search_results_list):
@@ -68,25 +100,211 @@ def reciprocal_rank_fusion(
         RRFResult(document=data["document"], rrf_score=data["rrf_score"], original_ranks=data["ranks"])
         for data in doc_scores.values()
     ]
-    return sorted(rrf_results, key=lambda x: x.rrf_score, reverse=True)
+    return sorted(rrf_results, key=lambda x: x.rrf_score, reverse=True)[:top_n]
 
 class CrossEncoderReranker:
-    def __init__(self, model_name: str = RERANKER_MODEL):
+    def __init__(self, model_name: str = RERANKER_MODEL, backend: str = RERANKER_BACKEND):
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Loading Cross-Encoder {model_name} on {device}")
-        self.model = CrossEncoder(model_name, device=device)
+        self.device = device
+        self.session = None
+        self.autocast_dtype = None
+        if device == "cpu":
+            torch.set_num_threads(os.cpu_count())
+        if backend == "onnx" or (backend == "auto" and device == "cpu"):
+            try:
+                self._load_onnx(model_name)
+            except Exception as e:
+                logger.warning(f"ONNX reranker unavailable, falling back to PyTorch: {e}")
+        if self.session is None:
+            logger.info(f"Loading Cross-Encoder {model_name} on {device}")
+            self.model = CrossEncoder(model_name, device=device, max_length=RERANKER_MAX_LENGTH)
+            self.tokenizer = self.model.tokenizer
+            self._optimize_torch_model()
+
+    def _optimize_torch_model(self):
+        """FP16 autocast on GPU / IPEX BF16 on CPU, then torch.compile, warmed up so the first query does not pay for it."""
+        if self.device == "cuda":
+            self.autocast_dtype = torch.float16
+        else:
+            try:
+                import intel_extension_for_pytorch as ipex
+                self.model.model = ipex.optimize(self.model.model.eval(), dtype=torch.bfloat16)
+                self.autocast_dtype = torch.bfloat16
+            except ImportError:
+                pass
+        if not RERANKER_COMPILE:
+            return
+        # Default mode: no CUDA graphs, whose per-thread state breaks when calls move between to_thread workers
+        self.model.model = torch.compile(self.model.model, dynamic=True)
+        try:
+            self.predict("warm-up", ["warm-up passage"])
+        except Exception as e:
+            logger.warning(f"Reranker warm-up failed: {e}")
+
+    def _load_onnx(self, model_name: str):
+        """Load the INT8 dynamically-quantized ONNX export of the cross-encoder, exporting it on first use."""
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        onnx_dir = os.path.join(RERANKER_ONNX_DIR, model_name.replace("/", "--") + "-onnx-int8")
+        onnx_path = os.path.join(onnx_dir, "model_quantized.onnx")
+        if not os.path.exists(onnx_path):
+            from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+            logger.info(f"Exporting Cross-Encoder {model_name} to quantized ONNX in {onnx_dir}")
+            # Export into a temp dir and swap it in, so a crash never leaves a model without its tokenizer
+            tmp_dir = onnx_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            ort_model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+            quantizer = ORTQuantizer.from_pretrained(ort_model)
+            quantizer.quantize(
+                save_dir=tmp_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_dir)
+            shutil.rmtree(onnx_dir, ignore_errors=True)
+            os.replace(tmp_dir, onnx_dir)
+        logger.info(f"Loading Cross-Encoder {model_name} (ONNX INT8) on cpu")
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = os.cpu_count()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        self.session = ort.InferenceSession(onnx_path, sess_options, providers=["CPUExecutionProvider"])
+        self.session_inputs = {i.name for i in self.session.get_inputs()}
+
+    @functools.cached_property
+    def _bert_layout(self) -> bool:
+        """Whether the tokenizer builds pairs as [CLS] query [SEP] passage [SEP], the layout _encode assembles by hand."""
+        cls_id, sep_id = self.tokenizer.cls_token_id, self.tokenizer.sep_token_id
+        if cls_id is None or sep_id is None:
+            return False
+        query_ids = self.tokenizer("query", add_special_tokens=False)["input_ids"]
+        passage_ids = self.tokenizer("passage", add_special_tokens=False)["input_ids"]
+        return self.tokenizer("query", "passage")["input_ids"] == [cls_id, *query_ids, sep_id, *passage_ids, sep_id]
+
+    def _encode(self, query_ids: List[int], passages_ids: List[List[int]]) -> Dict[str, np.ndarray]:
+        """Assemble padded [CLS] query [SEP] passage [SEP] inputs from pre-tokenized ids, truncating longest-first."""
+        budget = RERANKER_MAX_LENGTH - 3
+        pairs = []
+        for passage_ids in passages_ids:
+            # Same split as the tokenizer's longest_first: the longer side keeps the odd extra token
+            half = budget // 2 + (budget % 2 if len(query_ids) > len(passage_ids) else 0)
+            q = query_ids[:max(budget - len(passage_ids), half)]
+            pairs.append((q, passage_ids[:budget - len(q)]))
+        width = max(len(q) + len(p) for q, p in pairs) + 3
+        input_ids = np.full((len(pairs), width), self.tokenizer.pad_token_id, dtype=np.int64)
+        token_type_ids = np.zeros((len(pairs), width), dtype=np.int64)
+        attention_mask = np.zeros((len(pairs), width), dtype=np.int64)
+        cls_id, sep_id = self.tokenizer.cls_token_id, self.tokenizer.sep_token_id
+        for i, (q, p) in enumerate(pairs):
+            first, end = len(q) + 2, len(q) + len(p) + 3
+            input_ids[i, 0] = cls_id
+            input_ids[i, 1:first - 1] = q
+            input_ids[i, first - 1] = sep_id
+            input_ids[i, first:end - 1] = p
+            input_ids[i, end - 1] = sep_id
+            token_type_ids[i, first:end] = 1
+            attention_mask[i, :end] = 1
+        encoded = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.tokenizer.model_input_names:
+            encoded["token_type_ids"] = token_type_ids
+        return encoded
+
+    def _forward(self, encoded: Dict[str, np.ndarray]) -> np.ndarray:
+        if self.session is not None:
+            inputs = {name: value for name, value in encoded.items() if name in self.session_inputs}
+            return self.session.run(None, inputs)[0][:, 0]
+        inputs = {k: torch.from_numpy(v).to(self.device) for k, v in encoded.items()}
+        try:
+            return self._forward_torch(inputs)
+        except Exception as e:
+            if not hasattr(self.model.model, "_orig_mod"):
+                raise
+            logger.warning(f"Compiled reranker failed, switching to eager mode: {e}")
+            self.model.model = self.model.model._orig_mod
+            return self._forward_torch(inputs)
+
+    def _forward_torch(self, inputs: Dict[str, torch.Tensor]) -> np.ndarray:
+        with torch.inference_mode(), \
+                torch.autocast(self.device, dtype=self.autocast_dtype, enabled=self.autocast_dtype is not None):
+            outputs = self.model.model(**inputs)
+        return outputs.logits[:, 0].float().cpu().numpy()
+
+    def predict(self, query: str, passages: List[str], batch_size: int = RERANKER_BATCH_SIZE) -> np.ndarray:
+        """Score passages against the query as raw logits, batching passages of similar length together."""
+        # The query is shared by every pair: tokenize it once, and the passages once, without special tokens
+        query_ids = self.tokenizer(query, add_special_tokens=False)["input_ids"]
+        passages_ids = self.tokenizer(passages, add_special_tokens=False)["input_ids"]
+        order = np.argsort([len(ids) for ids in passages_ids], kind="stable")
+        scores = np.empty(len(passages), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            if self._bert_layout:
+                encoded = self._encode(query_ids, [passages_ids[i] for i in batch])
+            else:
+                # Other layouts (e.g. XLM-R/RoBERTa <s> q </s></s> p </s>) go through the tokenizer's own pair encoding
+                encoded = dict(self.tokenizer(
+                    [query] * len(batch), [passages[i] for i in batch],
+                    truncation=True, max_length=RERANKER_MAX_LENGTH, padding=True, return_tensors="np"
+                ))
+            scores[batch] = self._forward(encoded)
+        return scores
 
     def rerank(self, query: str, documents: List[Document], top_k: int = 10) -> List[Tuple[Document, float]]:
         if not documents:
             return []
-        pairs = [[query, doc.page_content] for doc in documents]
-        scores = self.model.predict(pairs, show_progress_bar=False)
+        scores = self.predict(query, [doc.page_content for doc in documents])
         return sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)[:top_k]
         
+class BM25sRetriever:
+    """BM25 over the Chroma corpus backed by bm25s (Numba scorer), exposing the invoke() of LangChain retrievers."""
+    def __init__(self, retriever: "bm25s.BM25", corpus, k: int = 20):
+        self.retriever = retriever
+        self.corpus = corpus
+        self.k = k
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], k: int = 20) -> "BM25sRetriever":
+        retriever = bm25s.BM25(backend="numba")
+        retriever.index([_preprocess(doc.page_content) for doc in documents], show_progress=False)
+        corpus = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents]
+        return cls(retriever, corpus, k=k)
+
+    @classmethod
+    def load(cls, path: str, k: int = 20) -> "BM25sRetriever":
+        retriever = bm25s.BM25.load(path, load_corpus=True, mmap=True)
+        retriever.backend = "numba"
+        retriever.activate_numba_scorer()
+        return cls(retriever, retriever.corpus, k=k)
+
+    def save(self, path: str):
+        self.retriever.save(path, corpus=self.corpus)
+
+    def warm_up(self):
+        """Run one throwaway query so the Numba scorer is JIT-compiled at startup, not on the first user query."""
+        token = next((token for token in self.retriever.vocab_dict if token), None)
+        if token is not None:
+            self.invoke(token)
+
+    def invoke(self, query: str) -> List[Document]:
+        tokens = _preprocess(query)
+        k = min(self.k, len(self.corpus))
+        # bm25s raises on an empty token list (e.g. a query of only punctuation); nothing can match it anyway
+        if not tokens or not k:
+            return []
+        entries = self.retriever.retrieve(
+            [tokens], corpus=self.corpus, k=k,
+            return_as="documents", show_progress=False
+        )
+        return [Document(page_content=entry["page_content"], metadata=entry["metadata"]) for entry in entries[0]]
+
 class HybridRetrieverWithReranking:
-    def __init__(self, vectorstore: Chroma, bm25_retriever: BM25Retriever = None, reranker: CrossEncoderReranker = None,
-                 k_bm25: int = 20, k_semantic: int = 20, k_mmr: int = 20, k_final: int = 6):
+    def __init__(self, vectorstore: Chroma, bm25_retriever: BM25sRetriever = None, reranker: CrossEncoderReranker = None,
+                 k_bm25: int = 20, k_semantic: int = 20, k_mmr: int = 20, k_final: int = 6,
+                 embed_query: Optional[Callable[[str], List[float]]] = None):
         self.vectorstore = vectorstore
+        self.embed_query = embed_query or vectorstore.embeddings.embed_query
         self.bm25_retriever = bm25_retriever
         self.reranker = reranker
         self.k_bm25 = k_bm25
@@ -94,34 +312,55 @@ class HybridRetrieverWithReranking:
         self.k_mmr = k_mmr
         self.k_final = k_final
 
-    def _perform_searches(self, query: str) -> List[List[Document]]:
-        search_results = []
-        # BM25
-        if self.bm25_retriever:
+    def _vector_searches(self, query: str) -> Tuple[List[Document], List[Document]]:
+        """Embed the query once and derive both the semantic and the MMR lists from a single Chroma query."""
+        query_vector = self.embed_query(query)
+        result = self.vectorstore._collection.query(
+            query_embeddings=[query_vector],
+            n_results=max(self.k_semantic, self.k_mmr*2),
+            include=["embeddings", "documents", "metadatas"],
+        )
+        candidates = [
+            Document(page_content=content, metadata=metadata or {}, id=doc_id)
+            for content, metadata, doc_id in zip(result["documents"][0], result["metadatas"][0], result["ids"][0])
+        ]
+        semantic_results = candidates[:self.k_semantic]
+        mmr_results = []
+        if candidates:
             try:
-                bm25_results = self.bm25_retriever.invoke(query)[:self.k_bm25]
-                search_results.append(bm25_results)
+                mmr_indices = maximal_marginal_relevance(
+                    np.array(query_vector, dtype=np.float32), result["embeddings"][0], k=self.k_mmr
+                )
+                mmr_results = [candidates[i] for i in mmr_indices]
             except Exception as e:
-                logger.warning(f"BM25 failed: {e}")
-        # Semantic
-        try:
-            semantic_results = self.vectorstore.similarity_search(query, k=self.k_semantic)
-            search_results.append(semantic_results)
-        except Exception as e:
-            logger.warning(f"Semantic failed: {e}")
-        # MMR
-        try:
-            mmr_results = self.vectorstore.max_marginal_relevance_search(query, k=self.k_mmr, fetch_k=self.k_mmr*2)
-            search_results.append(mmr_results)
-        except Exception as e:
-            logger.warning(f"MMR failed: {e}")
+                logger.warning(f"MMR failed: {e}")
+        return semantic_results, mmr_results
+
+    async def _perform_searches(self, query: str) -> List[List[Document]]:
+        searches = {}
+        # BM25
+        if self.bm25_retriever:
+            searches["BM25"] = asyncio.to_thread(self.bm25_retriever.invoke, query)
+        # Semantic + MMR
+        searches["Semantic"] = asyncio.to_thread(self._vector_searches, query)
+        results = await asyncio.gather(*searches.values(), return_exceptions=True)
+        search_results = []
+        for name, result in zip(searches, results):
+            if isinstance(result, Exception):
+                logger.warning(f"{name} failed: {result}")
+            elif name == "BM25":
+                search_results.append(result[:self.k_bm25])
+            else:
+                search_results.extend(result)
         return search_results
 
-    def retrieve(self, query: str) -> List[Tuple[Document, float]]:
-        search_results = self._perform_searches(query)
+    async def fuse(self, query: str) -> List[RRFResult]:
+        search_results = await self._perform_searches(query)
         if not search_results:
             return []
-        rrf_results = reciprocal_rank_fusion(search_results)
+        return reciprocal_rank_fusion(search_results, top_n=self.k_semantic)
+
+    def rerank(self, query: str, rrf_results: List[RRFResult]) -> List[Tuple[Document, float]]:
         top_rrf_docs = [r.document for r in rrf_results[:self.k_semantic]]
         if self.reranker and top_rrf_docs:
             try:
@@ -130,77 +369,155 @@ class HybridRetrieverWithReranking:
                 logger.warning(f"Reranking failed: {e}")
         return [(r.document, r.rrf_score) for r in rrf_results[:self.k_final]]
 
+    async def retrieve(self, query: str) -> List[Tuple[Document, float]]:
+        rrf_results = await self.fuse(query)
+        return await asyncio.to_thread(self.rerank, query, rrf_results)
+
 class RAGEngine:
     """FastAPI compatible RAG engine, keeps BM25 methods and stream_query"""
     def __init__(self):
         self.db_dir = DB_DIR
         device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info(f"Using device: {device}")
-        # Embeddings
-        self.embedding_function = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL,
-            model_kwargs={"device": device},
-            encode_kwargs={"normalize_embeddings": True}
-        )
+        if device == "cuda":
+            torch.cuda.init()
+        # Embeddings, reranker and BM25 index are independent: load them concurrently
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            embeddings_future = executor.submit(
+                HuggingFaceEmbeddings,
+                model_name=EMBEDDING_MODEL,
+                model_kwargs={"device": device},
+                encode_kwargs={"normalize_embeddings": True}
+            )
+            reranker_future = executor.submit(CrossEncoderReranker)
+            bm25_future = executor.submit(self._load_bm25_retriever)
+            # Embeddings
+            self.embedding_function = embeddings_future.result()
+            # BM25
+            self.bm25_retriever = None
+            try:
+                self.bm25_retriever = bm25_future.result()
+            except Exception as e:
+                logger.warning(f"BM25 init failed: {e}")
+            # Reranker
+            self.reranker = reranker_future.result()
+        # Keyed on the normalized question, but the model embeds the original casing
+        self._embed_cached = cachetools.cached(
+            cache=cachetools.LRUCache(maxsize=EMBEDDING_CACHE_SIZE), key=normalize_question, lock=threading.Lock()
+        )(lambda text: tuple(self.embedding_function.embed_query(text.strip())))
+        # Retrieval caches: exact (hashed normalized question) and semantic (query vector similarity)
+        self._retrieval_cache = cachetools.TTLCache(maxsize=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+        self._semantic_keys: List[str] = []
+        self._semantic_vectors: Optional[np.ndarray] = None
         # Vectorstore
         self.vectorstore = Chroma(persist_directory=self.db_dir, embedding_function=self.embedding_function)
-        # BM25
-        self.bm25_retriever = None
-        try:
-            data = self.vectorstore.get()
-            documents = [Document(page_content=c, metadata=m) for c, m in zip(data['documents'], data['metadatas'])]
-            if documents:
-                self.bm25_retriever = BM25Retriever.from_documents(documents)
-                self.bm25_retriever.k = 20
-        except Exception as e:
-            logger.warning(f"BM25 init failed: {e}")
-        # Reranker
-        self.reranker = CrossEncoderReranker()
         # Hybrid Retriever
         self.hybrid_retriever = HybridRetrieverWithReranking(
             vectorstore=self.vectorstore,
             bm25_retriever=self.bm25_retriever,
-            reranker=self.reranker
+            reranker=self.reranker,
+            embed_query=self.embed_query
         )
         # LLM
         self.llm = ChatOllama(model=LLM_MODEL, base_url=OLLAMA_URL, temperature=0.0, num_ctx=4096, top_p=0.95, repeat_penalty=1.1)
         self.is_ready = True
 
-    def stream_query(self, question: str, top_k: int = 6) -> Generator[str, None, None]:
+    def _load_bm25_retriever(self) -> Optional[BM25sRetriever]:
+        """Load the saved BM25 index if it is newer than the Chroma store, otherwise rebuild and persist it."""
+        chroma_db = os.path.join(self.db_dir, "chroma.sqlite3")
+        params_path = os.path.join(BM25_INDEX_DIR, "params.index.json")
+        if os.path.exists(params_path) and os.path.exists(chroma_db) \
+                and os.path.getmtime(params_path) >= os.path.getmtime(chroma_db):
+            try:
+                retriever = BM25sRetriever.load(BM25_INDEX_DIR)
+                logger.info(f"Loaded BM25 index from {BM25_INDEX_DIR}")
+                retriever.warm_up()
+                return retriever
+            except Exception as e:
+                logger.warning(f"Could not load BM25 index, rebuilding: {e}")
+        # Runs alongside the embedding model load, so read the corpus without an embedding function
+        data = Chroma(persist_directory=self.db_dir).get()
+        documents = [Document(page_content=c, metadata=m) for c, m in zip(data['documents'], data['metadatas'])]
+        if not documents:
+            return None
+        retriever = BM25sRetriever.from_documents(documents, k=20)
+        try:
+            tmp_dir = f"{BM25_INDEX_DIR}.{os.getpid()}.tmp"
+            retriever.save(tmp_dir)
+            shutil.rmtree(BM25_INDEX_DIR, ignore_errors=True)
+            os.replace(tmp_dir, BM25_INDEX_DIR)
+            logger.info(f"Saved BM25 index to {BM25_INDEX_DIR}")
+        except Exception as e:
+            logger.warning(f"Could not save BM25 index: {e}")
+        retriever.warm_up()
+        return retriever
+
+    def embed_query(self, text: str) -> List[float]:
+        return list(self._embed_cached(text))
+
+    def _semantic_cache_lookup(self, query_vector: np.ndarray) -> Optional[List[Tuple[Document, float]]]:
+        if self._semantic_vectors is None or not len(self._semantic_keys):
+            return None
+        similarities = self._semantic_vectors @ query_vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < SEMANTIC_CACHE_THRESHOLD:
+            return None
+        return self._retrieval_cache.get(self._semantic_keys[best])
+
+    def _cache_store(self, key: str, query_vector: np.ndarray, docs_with_scores: List[Tuple[Document, float]]):
+        self._retrieval_cache[key] = docs_with_scores
+        # Drop semantic entries whose exact entry expired or was evicted, keeping at most RETRIEVAL_CACHE_SIZE
+        keep = [i for i, k in enumerate(self._semantic_keys) if k in self._retrieval_cache and k != key]
+        keep = keep[-(RETRIEVAL_CACHE_SIZE - 1):] if RETRIEVAL_CACHE_SIZE > 1 else []
+        vectors = [self._semantic_vectors[keep]] if keep else []
+        self._semantic_keys = [self._semantic_keys[i] for i in keep] + [key]
+        self._semantic_vectors = np.vstack(vectors + [query_vector[None, :]])
+
+    async def _cache_lookup(self, question: str) -> Tuple[str, Optional[np.ndarray], Optional[List[Tuple[Document, float]]]]:
+        key = hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+        cached = self._retrieval_cache.get(key)
+        query_vector = None
+        if cached is None:
+            try:
+                query_vector = np.asarray(await asyncio.to_thread(self.embed_query, question), dtype=np.float32)
+            except Exception as e:
+                # Leave the retrieval to the hybrid retriever, whose BM25 leg still answers without embeddings
+                logger.warning(f"Query embedding failed, skipping the semantic cache: {e}")
+                return key, None, None
+            cached = self._semantic_cache_lookup(query_vector)
+        return key, query_vector, cached
+
+    @staticmethod
+    def _metadata_header(docs: List[Document]) -> str:
+        sources = [f"{doc.metadata.get('source')} (p.{doc.metadata.get('page')})" for doc in docs]
+        payload = json.dumps({"sources": list(dict.fromkeys(sources))})
+        return f"METADATA_START:{payload}:METADATA_END\n\n"
+
+    @staticmethod
+    def _build_system_prompt(docs_with_scores: List[Tuple[Document, float]]) -> str:
+        buf = [SYSTEM_PROMPT_PREFIX]
+        for i, (doc, score) in enumerate(docs_with_scores):
+            if i:
+                buf.append(CONTEXT_SEPARATOR)
+            buf.append(f"Source: {doc.metadata.get('source')}, Page: {doc.metadata.get('page')}\n{doc.page_content}")
+        buf.append(SYSTEM_PROMPT_SUFFIX)
+        return "".join(buf)
+
+    async def stream_query(self, question: str, top_k: int = 6) -> AsyncGenerator[str, None]:
         if not self.is_ready:
             yield "SYSTEM_ERROR: RAG Engine not ready."
             return
         # Retrieve documents
-        docs_with_scores = self.hybrid_retriever.retrieve(question)
-        context_parts, sources = [], []
-        for doc, score in docs_with_scores:
-            context_parts.append(f"Source: {doc.metadata.get('source')}, Page: {doc.metadata.get('page')}\n{doc.page_content}")
-            sources.append(f"{doc.metadata.get('source')} (p.{doc.metadata.get('page')})")
-        context_str = "\n\n---\n\n".join(context_parts)
-        yield f"METADATA_START:{str({'sources': list(set(sources)), 'context': context_str})}:METADATA_END\n\n"
-        messages = [SystemMessage(content=SYSTEM_PROMPT.format(context=context_str)), HumanMessage(content=question)]
+        key, query_vector, docs_with_scores = await self._cache_lookup(question)
+        if docs_with_scores is None:
+            docs_with_scores = await self.hybrid_retriever.retrieve(question)
+            if docs_with_scores and query_vector is not None:
+                self._cache_store(key, query_vector, docs_with_scores)
+        yield self._metadata_header([doc for doc, _ in docs_with_scores])
+        messages = [SystemMessage(content=self._build_system_prompt(docs_with_scores)), HumanMessage(content=question)]
         try:
-            for chunk in self.llm.stream(messages):
+            async for chunk in self.llm.astream(messages):
                 if chunk.content:
                     yield chunk.content
         except Exception as e:
             yield f"SYSTEM_ERROR: LLM generation failed: {e}"
-
-
-app = FastAPI()
-rag_engine = RAGEngine()
-
-@app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
-    question = request.question
-    if not question.strip():
-        raise HTTPException(status_code=400, detail="Question cannot be empty")
-    def generator():
-        yield from rag_engine.stream_query(question)
-    return StreamingResponse(generator(), media_type="text/plain")
-
-@app.get("/health")
-async def health_check():
-    return {"status": "ok", "rag_ready": rag_engine.is_ready}
-
-
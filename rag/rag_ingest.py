@@ -2,9 +2,12 @@ import os
 import logging
 import shutil
 import re
-from typing import List, Dict, Tuple
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
 
+import chromadb
 import fitz
 import torch
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -33,6 +36,9 @@ logger = logging.getLogger(__name__)
 
 DATA_DIR = "data/raw"
 DB_DIR = "vectorstore"
+COLLECTION_NAME = "langchain"  # default collection opened by langchain_chroma.Chroma in rag_engine
+EMBEDDING_BATCH_SIZE = 128
+CHROMA_BATCH_SIZE = 5000
 
 def extract_text_from_pdf(pdf_path: str) -> List[Dict]:
     doc_content = []
@@ -45,20 +51,13 @@ def extract_text_from_pdf(pdf_path: str) -> List[Dict]:
         for page_num in range(len(doc)):
             page = doc[page_num]
             
-            blocks = page.get_text("dict")["blocks"]
-            page_text_parts = []
+            full_text = page.get_text("text")
             
-            for block in blocks:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            text = span["text"].strip()
-                            if text:
-                                if normalizer.is_section_header(text):
-                                    current_section = text
-                                page_text_parts.append(text)
+            for line in full_text.splitlines():
+                line = line.strip()
+                if line and len(line) < 120 and normalizer.is_section_header(line):
+                    current_section = line
             
-            full_text = " ".join(page_text_parts)
             full_text = normalizer.normalize_text(full_text)
             
             if full_text.strip():
@@ -91,7 +90,13 @@ class E5EmbeddingsWithPrefix(HuggingFaceEmbeddings):
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         prefixed_texts = [f"passage: {text}" for text in texts]
-        return super().embed_documents(prefixed_texts)
+        # SentenceTransformer.encode already batches by sorted length; call it directly to skip LangChain's per-text work
+        embeddings = self._client.encode(
+            prefixed_texts,
+            show_progress_bar=self.show_progress,
+            **self.encode_kwargs
+        )
+        return embeddings.tolist()
     
     def embed_query(self, text: str) -> List[float]:
         prefixed_text = f"query: {text}"
@@ -146,7 +151,8 @@ class RRFResult:
 
 def reciprocal_rank_fusion(
     search_results_list: List[List[Document]],
-    k: int = 60
+    k: int = 60,
+    top_n: Optional[int] = None
 ) -> List[RRFResult]:
     doc_scores = {}
     
@@ -174,8 +180,7 @@ def reciprocal_rank_fusion(
     ]
     
     rrf_results.sort(key=lambda x: x.rrf_score, reverse=True)
-    
-    return rrf_results
+    return rrf_results[:top_n]
 
 class CrossEncoderReranker:
     
@@ -239,7 +244,8 @@ class HybridRetrieverWithReranking:
         
         rrf_results = reciprocal_rank_fusion(
             [semantic_results, mmr_results],
-            k=60
+            k=60,
+            top_n=self.k_semantic
         )
         logger.info(f"  RRF fusion: {len(rrf_results)} unique documents")
         
@@ -268,16 +274,18 @@ def ingest_documents():
         logger.warning(f"No PDFs found in {DATA_DIR}")
         return
 
+    pdf_paths = [os.path.join(DATA_DIR, pdf_file) for pdf_file in pdf_files]
+    max_workers = min(len(pdf_paths), os.cpu_count() or 1)
+    logger.info(f"Processing {len(pdf_paths)} PDFs with {max_workers} workers...")
+
     raw_documents = []
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(DATA_DIR, pdf_file)
-        logger.info(f"Processing {pdf_file}...")
-        extracted = extract_text_from_pdf(pdf_path)
-        for data in extracted:
-            raw_documents.append(Document(
-                page_content=data["page_content"],
-                metadata=data["metadata"]
-            ))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for extracted in executor.map(extract_text_from_pdf, pdf_paths):
+            for data in extracted:
+                raw_documents.append(Document(
+                    page_content=data["page_content"],
+                    metadata=data["metadata"]
+                ))
 
     logger.info(f"Extraction: {len(raw_documents)} pages")
 
@@ -292,20 +300,49 @@ def ingest_documents():
     device = 'cuda' if torch.cuda.is_available() and os.environ.get("USE_GPU", "1") == "1" else 'cpu'
     logger.info(f"Generating embeddings (Device: {device})...")
 
+    model_kwargs = {'device': device}
+    if device == 'cuda':
+        model_kwargs['model_kwargs'] = {'torch_dtype': torch.float16}
+
     embeddings = E5EmbeddingsWithPrefix(
         model_name="intfloat/multilingual-e5-large",
-        model_kwargs={'device': device},
-        encode_kwargs={'normalize_embeddings': True}
+        model_kwargs=model_kwargs,
+        encode_kwargs={
+            'normalize_embeddings': True,
+            'batch_size': EMBEDDING_BATCH_SIZE,
+            'convert_to_numpy': True
+        },
+        show_progress=True
     )
 
     if os.path.exists(DB_DIR):
         logger.info(f"Rebuilding vectorstore...")
         shutil.rmtree(DB_DIR)
 
-    vectorstore = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=DB_DIR
+    texts = [chunk.page_content for chunk in chunks]
+
+    client = chromadb.PersistentClient(path=DB_DIR)
+    collection = client.get_or_create_collection(
+        COLLECTION_NAME,
+        metadata={"hnsw:space": "cosine", "hnsw:construction_ef": 200, "hnsw:M": 16}
+    )
+    ids = [str(uuid.uuid4()) for _ in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    batch_size = min(CHROMA_BATCH_SIZE, client.get_max_batch_size())
+    # Embed one Chroma batch at a time so only that batch's vectors are held in memory
+    for start in range(0, len(chunks), batch_size):
+        end = start + batch_size
+        collection.add(
+            ids=ids[start:end],
+            embeddings=embeddings.embed_documents(texts[start:end]),
+            documents=texts[start:end],
+            metadatas=metadatas[start:end]
+        )
+
+    vectorstore = Chroma(
+        client=client,
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings
     )
 
     logger.info(f"Ingestion completed! {len(chunks)} chunks indexed")
@@ -77,12 +77,17 @@ async function chatRoutes(fastify, options) {
         if (metaStart !== -1 && metaEnd !== -1) {
           const jsonStr = aiResText.slice(metaStart + 15, metaEnd);
           try {
-            const jsonStr_fixed = jsonStr
-              .replace(/'/g, '"')
-              .replace(/True/g, 'true')
-              .replace(/False/g, 'false')
-              .replace(/None/g, 'null');
-            const metadata = JSON.parse(jsonStr_fixed);
+            let metadata;
+            try {
+              metadata = JSON.parse(jsonStr);
+            } catch (_) {
+              const jsonStr_fixed = jsonStr
+                .replace(/'/g, '"')
+                .replace(/True/g, 'true')
+                .replace(/False/g, 'false')
+                .replace(/None/g, 'null');
+              metadata = JSON.parse(jsonStr_fixed);
+            }
             sources = metadata.sources || [];
           } catch (jsonErr) {
             console.error("Failed to parse metadata JSON:", jsonErr);